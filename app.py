@@ -2,7 +2,6 @@
 AskURL - Ask Questions About Web Content
 """
 import streamlit as st
-import time
 from config import PAGE_TITLE, PAGE_ICON
 from utils.document_processor import DocumentProcessor
 from utils.qa_chain import QAChain
@@ -26,9 +25,43 @@ if 'urls_processed' not in st.session_state:
     st.session_state.urls_processed = False
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'rendered_history_md' not in st.session_state:
+    st.session_state.rendered_history_md = ""  # Older turns as one Markdown blob
+    st.session_state.rendered_history_len = 0  # Messages folded into the blob
+
+@st.cache_resource
+def get_doc_processor():
+    """Create the document processor once and reuse it across reruns"""
+    return DocumentProcessor()
+
+
+@st.cache_resource(max_entries=4)
+def get_qa_chain(vectorstore_id: str, _vectorstore):
+    """Create one QA chain per vector store and reuse it across reruns"""
+    return QAChain(_vectorstore)
+
+
+def reset_chat():
+    """Clear the conversation and its rendered history"""
+    st.session_state.chat_history = []
+    st.session_state.rendered_history_md = ""
+    st.session_state.rendered_history_len = 0
+
+
+def format_message_md(message: dict) -> str:
+    """Render a chat message, with its sources, as Markdown"""
+    if message["role"] == "user":
+        md = f"**🧑 You:** {message['content']}\n\n"
+    else:
+        md = f"**🤖 Assistant:** {message['content']}\n\n"
+        if message.get("sources"):
+            md += "**Sources:**\n" + "".join(f"- {source}\n" for source in message["sources"]) + "\n"
+        md += "---\n\n"
+    return md
+
 
 # Initialize document processor
-doc_processor = DocumentProcessor()
+doc_processor = get_doc_processor()
 
 # Sidebar for URL input
 with st.sidebar:
@@ -53,35 +86,31 @@ with st.sidebar:
             
             if len(urls) > 0:
                 try:
-                    # Show progress: Loading
-                    main_placeholder.text("Data Loading...Started...✅✅✅")
-                    time.sleep(0.5)
-                    
-                    # Load URLs
-                    documents = doc_processor.load_urls(urls)
-                    
-                    # Show progress: Text Splitting
-                    main_placeholder.text("Text Splitter...Started...✅✅✅")
-                    time.sleep(0.5)
-                    
-                    # Split documents
-                    chunks = doc_processor.split_documents(documents)
-                    
-                    # Show progress: Embedding
-                    main_placeholder.text("Embedding Vector Started Building...✅✅✅")
-                    time.sleep(0.5)
-                    
-                    # Create vector store
-                    vectorstore = doc_processor.create_vectorstore(chunks)
-                    
-                    # Save the index
-                    doc_processor.save_vectorstore(vectorstore)
+                    # Progress updates render live, no delays needed
+                    with st.status("Processing URLs...", expanded=True) as status:
+                        # Load URLs
+                        status.update(label="Data Loading...Started...⏳")
+                        documents = doc_processor.load_urls(urls)
+                        
+                        # Split documents
+                        status.update(label="Text Splitter...Started...⏳")
+                        chunks = doc_processor.split_documents(documents)
+                        
+                        # Create vector store
+                        status.update(label="Embedding Vector Started Building...⏳")
+                        vectorstore = doc_processor.create_vectorstore(chunks)
+                        
+                        # Save the index
+                        status.update(label="Saving index...⏳")
+                        doc_processor.save_vectorstore(vectorstore)
+                        
+                        status.update(label="Processing complete", state="complete", expanded=False)
                     
                     # Store vectorstore and create QA chain
                     st.session_state.vectorstore = vectorstore
-                    st.session_state.qa_chain = QAChain(vectorstore)
+                    st.session_state.qa_chain = get_qa_chain(QAChain.vectorstore_id(vectorstore), vectorstore)
                     st.session_state.urls_processed = True
-                    st.session_state.chat_history = []
+                    reset_chat()
                     
                     main_placeholder.success(f"✅ Processed {len(documents)} documents into {len(chunks)} chunks & saved index!")
                     
@@ -97,16 +126,15 @@ with st.sidebar:
             # Check if index exists
             if doc_processor.index_exists():
                 main_placeholder.text("Loading existing index...⏳")
-                time.sleep(0.3)
                 
                 # Load the vectorstore
                 vectorstore = doc_processor.load_vectorstore()
                 
                 if vectorstore:
                     st.session_state.vectorstore = vectorstore
-                    st.session_state.qa_chain = QAChain(vectorstore)
+                    st.session_state.qa_chain = get_qa_chain(QAChain.vectorstore_id(vectorstore), vectorstore)
                     st.session_state.urls_processed = True
-                    st.session_state.chat_history = []
+                    reset_chat()
                     
                     main_placeholder.success("✅ Loaded existing index successfully!")
                 else:
@@ -127,8 +155,19 @@ with st.sidebar:
 if st.session_state.urls_processed:
     st.header("💬 Ask Questions")
     
-    # Display chat history
-    for message in st.session_state.chat_history:
+    # Fold everything before the latest turn into the Markdown history once,
+    # so earlier turns cost a single element per rerun
+    history = st.session_state.chat_history
+    fold_until = max(len(history) - 2, st.session_state.rendered_history_len)
+    for message in history[st.session_state.rendered_history_len:fold_until]:
+        st.session_state.rendered_history_md += format_message_md(message)
+    st.session_state.rendered_history_len = fold_until
+    
+    if st.session_state.rendered_history_md:
+        st.markdown(st.session_state.rendered_history_md)
+    
+    # Display the latest turn with full chat widgets
+    for message in history[st.session_state.rendered_history_len:]:
         with st.chat_message(message["role"]):
             if message["role"] == "assistant":
                 # Display answer
@@ -137,10 +176,8 @@ if st.session_state.urls_processed:
                 if "sources" in message and message["sources"]:
                     st.divider()
                     st.caption("**Sources:**")
-                    sources_list = message["sources"].split("\n")
-                    for source in sources_list:
-                        if source.strip():
-                            st.caption(f"• {source.strip()}")
+                    for source in message["sources"]:
+                        st.caption(f"• {source}")
             else:
                 st.markdown(message["content"])
     
@@ -157,36 +194,33 @@ if st.session_state.urls_processed:
         
         # Generate answer
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    # Get answer with sources using QA chain
-                    result = st.session_state.qa_chain.ask_with_sources(question)
-                    answer = result.get("answer", "")
-                    sources = result.get("sources", "")
-                    
-                    # Display answer
-                    st.markdown(answer)
-                    
-                    # Display sources
-                    if sources:
-                        st.divider()
-                        st.caption("**Sources:**")
-                        sources_list = sources.split("\n")
-                        for source in sources_list:
-                            if source.strip():
-                                st.caption(f"• {source.strip()}")
-                    
-                    # Add to chat history
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": answer,
-                        "sources": sources
-                    })
-                    
-                except Exception as e:
-                    error_msg = f"❌ Error generating answer: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.chat_history.append({"role": "assistant", "content": error_msg})
+            try:
+                # Retrieve sources before the answer starts streaming
+                with st.spinner("Thinking..."):
+                    result = st.session_state.qa_chain.stream_with_sources(question)
+                sources = result.get("sources", [])
+                
+                # Display answer as it is generated
+                answer = st.write_stream(result["answer"])
+                
+                # Display sources
+                if sources:
+                    st.divider()
+                    st.caption("**Sources:**")
+                    for source in sources:
+                        st.caption(f"• {source}")
+                
+                # Add to chat history
+                st.session_state.chat_history.append({
+                    "role": "assistant",
+                    "content": answer,
+                    "sources": sources
+                })
+                
+            except Exception as e:
+                error_msg = f"❌ Error generating answer: {str(e)}"
+                st.error(error_msg)
+                st.session_state.chat_history.append({"role": "assistant", "content": error_msg})
 else:
     st.info("👈 Please add URLs in the sidebar and click 'Process URLs' to begin.")
     
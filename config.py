@@ -2,6 +2,7 @@
 Configuration settings for the News Search Tool
 """
 import os
+import httpx
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -10,21 +11,62 @@ load_dotenv()
 # API Configuration
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 BASE_URL = "https://models.inference.ai.azure.com"
+# OpenAI-compatible chat endpoint; point at a vLLM server started with
+# --enable-prefix-caching to reuse the KV cache of repeated context chunks
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", BASE_URL)
+
+# Shared HTTP client so the LLM and embedding clients reuse pooled
+# keep-alive connections (and HTTP/2 multiplexing) instead of
+# reconnecting per client
+HTTP_CLIENT = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    timeout=60
+)
 
 # Model Configuration
-LLM_MODEL = "gpt-4o"
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")  # Must match the name LLM_BASE_URL serves
 EMBEDDING_MODEL = "text-embedding-3-small"
 LLM_TEMPERATURE = 0
 
+# Embedding Configuration
+EMBEDDING_BATCH_SIZE = 96  # Chunks sent per embedding request
+EMBEDDING_MAX_WORKERS = 8  # Concurrent embedding requests
+
+# URL Loading Configuration
+URL_FETCH_TIMEOUT = 30  # Seconds to wait for each URL
+URL_FETCH_MAX_WORKERS = 16  # Concurrent URL downloads
+
 # Text Splitting Configuration
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+TOKENIZER_ENCODING = "cl100k_base"  # tiktoken encoding used to measure chunks
+CHUNK_SIZE = 256  # Tokens per chunk
+CHUNK_OVERLAP = 50  # Tokens shared between neighbouring chunks
 
 # Retrieval Configuration
-RETRIEVAL_K = 3  # Number of documents to retrieve
+RETRIEVAL_K = 3  # Full-size chunks' worth of context per question
+RETRIEVAL_FETCH_K = 2 * RETRIEVAL_K  # Candidates retrieved before fitting the budget
+# Max chunk tokens put in the prompt; shorter chunks let more candidates in.
+# Counted with TOKENIZER_ENCODING (the embedding tokenizer), so this is an
+# approximation of the LLM's own token count
+CONTEXT_TOKEN_BUDGET = RETRIEVAL_K * CHUNK_SIZE
+
+# FAISS Index Configuration
+FAISS_HNSW_M = 32  # Graph neighbours per vector in the HNSW index
+FAISS_HNSW_EF_CONSTRUCTION = 200  # Candidate list size while building the graph
+FAISS_HNSW_EF_SEARCH = 64  # Candidate list size while searching
+FAISS_USE_IVFPQ = False  # Use product quantization (IndexIVFPQ) for very large corpora
+FAISS_IVFPQ_MIN_VECTORS = 50000  # Smaller corpora keep the HNSW index
+FAISS_IVFPQ_M = 64  # Sub-quantizers per vector (must divide the embedding dimension)
+FAISS_IVFPQ_NBITS = 8  # Bits per sub-quantizer code
+FAISS_IVFPQ_NPROBE = 16  # Inverted lists scanned per query
 
 # Persistence Configuration
 FAISS_INDEX_PATH = "faiss_store_openai.pkl"
+SEMANTIC_CACHE_PATH = "semantic_cache"  # Cached answers for near-duplicate questions
+
+# Semantic Cache Configuration
+SEMANTIC_CACHE_THRESHOLD = 0.95  # Minimum cosine similarity to reuse a cached answer
+SEMANTIC_CACHE_MAX_ENTRIES = 1000  # Oldest answers are evicted beyond this, bounding each save
 
 # Streamlit Configuration
 PAGE_TITLE = "AskURL"
@@ -1,31 +1,161 @@
 """
 Document processing utilities for loading and vectorizing content from URLs
 """
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
 import os
-from langchain_community.document_loaders import UnstructuredURLLoader
+import pickle
+import re
+import warnings
+import faiss
+import numpy as np
+import tiktoken
+from unstructured.partition.auto import partition
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
 from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_openai import OpenAIEmbeddings
 from config import (
     GITHUB_TOKEN,
+    HTTP_CLIENT,
     BASE_URL,
     EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_WORKERS,
+    URL_FETCH_TIMEOUT,
+    URL_FETCH_MAX_WORKERS,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
+    TOKENIZER_ENCODING,
+    FAISS_HNSW_M,
+    FAISS_HNSW_EF_CONSTRUCTION,
+    FAISS_HNSW_EF_SEARCH,
+    FAISS_USE_IVFPQ,
+    FAISS_IVFPQ_MIN_VECTORS,
+    FAISS_IVFPQ_M,
+    FAISS_IVFPQ_NBITS,
+    FAISS_IVFPQ_NPROBE,
     FAISS_INDEX_PATH
 )
 
+logger = logging.getLogger(__name__)
+
+
+class ColumnarDocstore(Docstore, AddableMixin):
+    """
+    Docstore keeping chunks in parallel columns instead of Document objects
+    
+    Texts live in one list, sources are interned and referenced by an
+    integer array, and any other metadata key gets its own column.
+    Documents are only materialized when FAISS looks them up.
+    """
+    
+    def __init__(self):
+        self.rows: Dict[str, int] = {}  # Docstore id -> row
+        self.texts: List[str] = []
+        self.sources: List[str] = []  # Unique sources, indexed by source_ids
+        self.source_ids = np.empty(0, dtype=np.int32)
+        self.columns: Dict[str, list] = {}  # Remaining metadata, one list per key
+        self._source_lookup: Dict[str, int] = {}
+    
+    def _intern_source(self, source: str) -> int:
+        """Return the id of a source, registering it if new"""
+        if source not in self._source_lookup:
+            self._source_lookup[source] = len(self.sources)
+            self.sources.append(source)
+        return self._source_lookup[source]
+    
+    def add(self, texts: Dict[str, Document]) -> None:
+        """
+        Add documents to the store
+        
+        Args:
+            texts: Mapping of docstore id to document
+        """
+        overlapping = set(texts).intersection(self.rows)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        
+        start = len(self.texts)
+        source_ids = []
+        for offset, (doc_id, doc) in enumerate(texts.items()):
+            row = start + offset
+            self.rows[doc_id] = row
+            self.texts.append(doc.page_content)
+            
+            metadata = dict(doc.metadata)
+            source = metadata.pop("source", None)
+            source_ids.append(-1 if source is None else self._intern_source(source))
+            
+            for key in metadata.keys() - self.columns.keys():
+                self.columns[key] = [None] * row
+            for key, column in self.columns.items():
+                column.append(metadata.get(key))
+        
+        self.source_ids = np.concatenate(
+            [self.source_ids, np.asarray(source_ids, dtype=np.int32)]
+        )
+    
+    def delete(self, ids: List) -> None:
+        """
+        Delete documents from the store
+        
+        Args:
+            ids: Docstore ids to delete
+        """
+        missing = set(ids).difference(self.rows)
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not exist: {missing}")
+        
+        removed = {self.rows[doc_id] for doc_id in ids}
+        keep = [row for row in range(len(self.texts)) if row not in removed]
+        
+        self.texts = [self.texts[row] for row in keep]
+        self.source_ids = self.source_ids[keep]
+        self.columns = {
+            key: [column[row] for row in keep] for key, column in self.columns.items()
+        }
+        remaining = sorted(
+            (row, doc_id) for doc_id, row in self.rows.items() if row not in removed
+        )
+        self.rows = {doc_id: new_row for new_row, (_, doc_id) in enumerate(remaining)}
+    
+    def search(self, search: str) -> Union[str, Document]:
+        """
+        Look up a document by docstore id
+        
+        Args:
+            search: Docstore id of the document
+            
+        Returns:
+            Document, or an error message string if the id is unknown
+        """
+        if search not in self.rows:
+            return f"ID {search} not found."
+        
+        row = self.rows[search]
+        metadata = {
+            key: column[row] for key, column in self.columns.items()
+            if column[row] is not None
+        }
+        source_id = self.source_ids[row]
+        if source_id >= 0:
+            metadata["source"] = self.sources[source_id]
+        return Document(page_content=self.texts[row], metadata=metadata)
+
 
 class DocumentProcessor:
     """Handles loading, splitting, and vectorizing documents from URLs"""
     
     def __init__(self):
         self.embeddings = None
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP
-        )
+        self.tokenizer = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        # Paragraph, line and sentence breaks, and their level (coarsest first)
+        self.separator_pattern = re.compile(r"(\n\n|\n|[.!?] )")
+        self.separator_levels = {"\n\n": 0, "\n": 1, ". ": 2, "! ": 2, "? ": 2}
     
     def _initialize_embeddings(self):
         """Initialize OpenAI embeddings"""
@@ -33,13 +163,39 @@ class DocumentProcessor:
             self.embeddings = OpenAIEmbeddings(
                 model=EMBEDDING_MODEL,
                 api_key=GITHUB_TOKEN,
-                base_url=BASE_URL
+                base_url=BASE_URL,
+                http_client=HTTP_CLIENT
             )
         return self.embeddings
     
+    def _load_url(self, url: str) -> Optional[Document]:
+        """
+        Fetch a single URL and extract its text
+        
+        Goes through unstructured's partition(url=...), the same path as
+        UnstructuredURLLoader, which fetches with safe_get (blocking private
+        and link-local addresses, including on redirects; unstructured
+        >= 0.24.0) and detects the file type from the response.
+        
+        Args:
+            url: URL string to load
+            
+        Returns:
+            Loaded document or None if the URL could not be fetched
+        """
+        try:
+            elements = partition(url=url, request_timeout=URL_FETCH_TIMEOUT)
+        except Exception as e:
+            # Skip failing URLs like UnstructuredURLLoader's continue_on_failure
+            logger.error(f"Error fetching or processing {url}, exception: {e}")
+            return None
+        
+        text = "\n\n".join(str(element) for element in elements)
+        return Document(page_content=text, metadata={"source": url})
+    
     def load_urls(self, urls: List[str]) -> List:
         """
-        Load content from a list of URLs
+        Load content from a list of URLs, fetching them concurrently
         
         Args:
             urls: List of URL strings to load
@@ -47,13 +203,159 @@ class DocumentProcessor:
         Returns:
             List of loaded documents
         """
-        loader = UnstructuredURLLoader(urls=urls)
-        documents = loader.load()
+        if not urls:
+            return []
+        
+        max_workers = min(URL_FETCH_MAX_WORKERS, len(urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(self._load_url, urls)
+        
+        documents = [doc for doc in results if doc is not None]
         return documents
     
+    def _fast_offsets(self, text: str):
+        """
+        Locate every separator in a text
+        
+        The text is scanned once by re.split. Offsets and levels are then
+        derived with map and numpy, with no per-match Python loop.
+        
+        Args:
+            text: Text to scan
+            
+        Returns:
+            Tuple of int32 arrays: offsets just past each separator, and the
+            separator's level (0 = paragraph, 1 = line, 2 = sentence)
+        """
+        # Alternates text, separator, text, ..., text
+        parts = self.separator_pattern.split(text)
+        ends = np.cumsum(np.fromiter(map(len, parts), dtype=np.int64, count=len(parts)))
+        offsets = ends[1::2]
+        levels = np.fromiter(
+            map(self.separator_levels.__getitem__, parts[1::2]),
+            dtype=np.int32,
+            count=len(parts) // 2
+        )
+        
+        keep = offsets < len(text)
+        return offsets[keep].astype(np.int32), levels[keep]
+    
+    def _token_windows(self, tokens: List[int]) -> List[List[int]]:
+        """Slice token ids into CHUNK_SIZE windows overlapping by CHUNK_OVERLAP"""
+        stride = CHUNK_SIZE - CHUNK_OVERLAP
+        return [
+            tokens[start:start + CHUNK_SIZE]
+            for start in range(0, max(len(tokens) - CHUNK_OVERLAP, 1), stride)
+        ]
+    
+    def _decode_windows(self, tokens: List[int]) -> List[Tuple[str, int]]:
+        """
+        Decode the token windows of an oversized segment into text
+        
+        A window edge can fall inside a multi-byte character. The partial
+        bytes are dropped instead of becoming U+FFFD. The full character is
+        still in the neighbouring window, because windows overlap.
+        
+        Returns:
+            List of (text, token count) pairs
+        """
+        windows = self._token_windows(tokens)
+        texts = self.tokenizer.decode_batch(windows, errors="ignore")
+        return [(text, len(window)) for text, window in zip(texts, windows)]
+    
+    def _split_span(self, text: str, bounds: np.ndarray, levels: np.ndarray,
+                    lengths: np.ndarray, segment_tokens: List[List[int]],
+                    first_segment: int, last_segment: int,
+                    level: int) -> List[Tuple[str, int]]:
+        """
+        Split segments [first_segment, last_segment) at separators up to level
+        
+        Spans are packed greedily into chunks of up to CHUNK_SIZE tokens,
+        carrying trailing spans of up to CHUNK_OVERLAP tokens into the next
+        chunk. A span longer than CHUNK_SIZE is split again at the next
+        finer level. Only a single segment that is still too long is cut
+        into token windows.
+        
+        Args:
+            text: Text being split
+            bounds: Character offset where each segment starts, plus len(text)
+            levels: Separator level at each boundary between segments
+            lengths: Token count of each segment
+            segment_tokens: Token ids of each segment
+            first_segment: First segment of the span
+            last_segment: Segment just past the end of the span
+            level: Coarsest separator level to split at
+            
+        Returns:
+            List of (chunk text, token count) pairs, counted as the sum of
+            the chunk's segment counts
+        """
+        inner = np.flatnonzero(levels[first_segment:last_segment - 1] <= level)
+        starts = np.concatenate(([first_segment], inner + first_segment + 1))
+        ends = np.append(starts[1:], last_segment)
+        span_lengths = np.add.reduceat(lengths[first_segment:last_segment], starts - first_segment)
+        
+        pieces = []
+        first, total = 0, 0
+        for i, length in enumerate(span_lengths):
+            if length > CHUNK_SIZE:
+                if i > first:
+                    pieces.append((text[bounds[starts[first]]:bounds[starts[i]]], total))
+                if ends[i] - starts[i] > 1:
+                    pieces.extend(self._split_span(
+                        text, bounds, levels, lengths, segment_tokens,
+                        starts[i], ends[i], level + 1
+                    ))
+                else:
+                    pieces.extend(self._decode_windows(segment_tokens[starts[i]]))
+                first, total = i + 1, 0
+                continue
+            
+            if total + length > CHUNK_SIZE and i > first:
+                pieces.append((text[bounds[starts[first]]:bounds[starts[i]]], total))
+                while i > first and (total > CHUNK_OVERLAP or total + length > CHUNK_SIZE):
+                    total -= span_lengths[first]
+                    first += 1
+            total += length
+        
+        if first < len(span_lengths):
+            pieces.append((text[bounds[starts[first]]:bounds[last_segment]], total))
+        
+        return pieces
+    
+    def _split_text(self, text: str, cuts: np.ndarray, levels: np.ndarray,
+                    segment_tokens: List[List[int]]) -> List[Tuple[str, int]]:
+        """
+        Split one text, starting at paragraph breaks and going finer only
+        inside spans that do not fit CHUNK_SIZE
+        
+        Args:
+            text: Text to split
+            cuts: Character offset where each segment starts
+            levels: Separator level at each boundary between segments
+            segment_tokens: Token ids of each segment
+            
+        Returns:
+            List of (chunk text, token count) pairs
+        """
+        lengths = np.asarray([len(tokens) for tokens in segment_tokens], dtype=np.int64)
+        bounds = np.append(cuts, len(text))
+        pieces = self._split_span(
+            text, bounds, levels, lengths, segment_tokens, 0, len(cuts), 0
+        )
+        return [(piece.strip(), int(count)) for piece, count in pieces if piece.strip()]
+    
     def split_documents(self, documents: List) -> List:
         """
-        Split documents into smaller chunks
+        Split documents into chunks of up to CHUNK_SIZE tokens overlapping
+        by up to CHUNK_OVERLAP tokens
+        
+        Separators are located with one re.split per document, and each
+        segment is tokenized once. Chunks are then sliced straight from the
+        original text. Each chunk gets a 'chunk_index' (ingestion order) and
+        a 'chunk_id' (content hash) in its metadata so prompts can be
+        assembled in a canonical order, and a 'token_len' for context
+        budgeting.
         
         Args:
             documents: List of documents to split
@@ -61,9 +363,150 @@ class DocumentProcessor:
         Returns:
             List of document chunks
         """
-        chunks = self.text_splitter.split_documents(documents)
+        chunks = []
+        for doc in documents:
+            text = doc.page_content
+            if not text:
+                continue
+            offsets, levels = self._fast_offsets(text)
+            cuts = np.concatenate(([0], offsets)).astype(np.int32)
+            bounds = np.append(cuts, len(text))
+            # Not encode_batch: its per-string thread-pool future costs more
+            # than encoding a sentence. Special-token text is plain text here
+            tokens = [
+                self.tokenizer.encode(text[bounds[i]:bounds[i + 1]], disallowed_special=())
+                for i in range(len(cuts))
+            ]
+            for chunk_text, token_len in self._split_text(text, cuts, levels, tokens):
+                # Lets the QA chain budget its context without re-tokenizing
+                metadata = dict(doc.metadata, token_len=token_len)
+                chunks.append(Document(page_content=chunk_text, metadata=metadata))
+        
+        for i, chunk in enumerate(chunks):
+            source = chunk.metadata.get("source", "")
+            digest = hashlib.sha1(f"{source}\n{chunk.page_content}".encode("utf-8"))
+            chunk.metadata["chunk_index"] = i
+            chunk.metadata["chunk_id"] = digest.hexdigest()[:16]
         return chunks
     
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts in batches, sending the batch requests concurrently
+        
+        Args:
+            texts: List of texts to embed
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        embeddings = self._initialize_embeddings()
+        
+        # The HTTP client releases the GIL while waiting on the network
+        with ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS) as executor:
+            results = executor.map(embeddings.embed_documents, self._batch_texts(texts))
+        
+        return [vector for batch in results for vector in batch]
+    
+    def _batch_texts(self, texts: List[str]) -> List[List[str]]:
+        """Group texts into embedding request batches"""
+        return [
+            texts[i:i + EMBEDDING_BATCH_SIZE]
+            for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+        ]
+    
+    def _build_index(self, vectors: np.ndarray):
+        """
+        Build an empty index for approximate nearest-neighbour search
+        
+        Vectors are stored with 8-bit scalar quantization, a quarter of the
+        memory of float32, after training the quantizer on the vectors.
+        The index ranks by inner product, which equals cosine similarity
+        for the normalized vectors the store holds. With FAISS_USE_IVFPQ,
+        corpora of at least FAISS_IVFPQ_MIN_VECTORS vectors use an
+        IndexIVFPQ instead, storing FAISS_IVFPQ_M-byte codes per vector.
+        
+        Args:
+            vectors: Normalized embedding matrix the index will hold
+            
+        Returns:
+            Trained FAISS index ready for vectors to be added
+        """
+        num_vectors, dim = vectors.shape
+        if FAISS_USE_IVFPQ and num_vectors >= FAISS_IVFPQ_MIN_VECTORS:
+            nlist = int(4 * np.sqrt(num_vectors))
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(
+                quantizer,
+                dim,
+                nlist,
+                FAISS_IVFPQ_M,
+                FAISS_IVFPQ_NBITS,
+                faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(vectors)
+            return index
+        
+        index = faiss.IndexHNSWSQ(
+            dim,
+            faiss.ScalarQuantizer.QT_8bit,
+            FAISS_HNSW_M,
+            faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+        index.train(vectors)
+        return index
+    
+    def _wrap_index(self, index, docstore, index_to_docstore_id: dict) -> FAISS:
+        """
+        Wrap a FAISS index in a LangChain vector store
+        
+        Inner-product indexes hold L2-normalized vectors, so their queries
+        are normalized too and a single inner product gives cosine
+        similarity. L2 indexes keep LangChain's defaults. FAISS.save_local
+        does not persist these options, so they are picked from the
+        index's metric whenever a store is built.
+        """
+        if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+            return FAISS(
+                embedding_function=self._initialize_embeddings(),
+                index=index,
+                docstore=docstore,
+                index_to_docstore_id=index_to_docstore_id
+            )
+        
+        with warnings.catch_warnings():
+            # LangChain assumes normalization only matters for L2 distance,
+            # but it is what turns inner product into cosine similarity
+            warnings.filterwarnings("ignore", message="Normalizing L2 is not applicable")
+            return FAISS(
+                embedding_function=self._initialize_embeddings(),
+                index=index,
+                docstore=docstore,
+                index_to_docstore_id=index_to_docstore_id,
+                normalize_L2=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+    
+    def _configure_search(self, index):
+        """Apply search-time parameters, which are not part of the saved index"""
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+        elif hasattr(index, "nprobe"):
+            index.nprobe = FAISS_IVFPQ_NPROBE
+    
+    def _build_vectorstore(self, texts: List[str], vectors: List[List[float]],
+                           metadatas: List[dict]) -> FAISS:
+        """Index precomputed embeddings in a new FAISS vector store"""
+        matrix = np.asarray(vectors, dtype="float32")
+        faiss.normalize_L2(matrix)
+        index = self._build_index(matrix)
+        vectorstore = self._wrap_index(index, ColumnarDocstore(), {})
+        # Already-normalized float32 rows: LangChain copies them as arrays
+        # instead of converting every Python float a second time
+        vectorstore.add_embeddings(list(zip(texts, matrix)), metadatas=metadatas)
+        self._configure_search(index)
+        return vectorstore
+    
     def create_vectorstore(self, documents: List) -> FAISS:
         """
         Create a FAISS vector store from documents
@@ -74,9 +517,13 @@ class DocumentProcessor:
         Returns:
             FAISS vector store
         """
-        embeddings = self._initialize_embeddings()
-        vectorstore = FAISS.from_documents(documents, embeddings)
-        return vectorstore
+        if not documents:
+            raise ValueError("No document chunks to index")
+        
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        vectors = self._embed_texts(texts)
+        return self._build_vectorstore(texts, vectors, metadatas)
     
     def save_vectorstore(self, vectorstore: FAISS, file_path: Optional[str] = None):
         """
@@ -92,9 +539,36 @@ class DocumentProcessor:
         # FAISS has its own save_local method
         vectorstore.save_local(file_path)
     
+    def _read_flags(self, index_file: str) -> int:
+        """
+        Pick the read_index flags that memory-map a saved index
+        
+        IO_FLAG_MMAP only maps IVF inverted lists, and HNSW-SQ8 codes are
+        flat codes, which need IO_FLAG_MMAP_IFC (faiss >= 1.11). The index
+        type is told from the file's fourcc: IVF indexes start with "Iw"
+        (or "Iv" for older files).
+        
+        Args:
+            index_file: Path to the saved index
+            
+        Returns:
+            Flags for faiss.read_index
+        """
+        with open(index_file, "rb") as f:
+            fourcc = f.read(4)
+        
+        mmap_flat_codes = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        if fourcc.startswith((b"Iw", b"Iv")) or mmap_flat_codes is None:
+            return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        return mmap_flat_codes | faiss.IO_FLAG_READ_ONLY
+    
     def load_vectorstore(self, file_path: Optional[str] = None) -> Optional[FAISS]:
         """
-        Load FAISS vector store from disk using FAISS's native load method
+        Load FAISS vector store from disk, memory-mapping the index
+        
+        The index file is opened read-only and memory-mapped (see
+        _read_flags), so its vector codes are paged in from the OS page
+        cache on demand; only the docstore pickle is fully deserialized.
         
         Args:
             file_path: Path to the index folder (defaults to config path)
@@ -106,12 +580,15 @@ class DocumentProcessor:
             file_path = FAISS_INDEX_PATH.replace('.pkl', '')
         
         if self.index_exists(file_path):
-            embeddings = self._initialize_embeddings()
-            vectorstore = FAISS.load_local(
-                file_path, 
-                embeddings,
-                allow_dangerous_deserialization=True
-            )
+            index_file = os.path.join(file_path, "index.faiss")
+            index = faiss.read_index(index_file, self._read_flags(index_file))
+            
+            # Same layout FAISS.save_local writes next to the index
+            with open(os.path.join(file_path, "index.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            
+            vectorstore = self._wrap_index(index, docstore, index_to_docstore_id)
+            self._configure_search(vectorstore.index)
             return vectorstore
         return None
     
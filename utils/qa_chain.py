@@ -1,65 +1,260 @@
 """
 Question-answering chain utilities for RAG-based querying
 """
+from typing import Iterator, List, Optional
+import hashlib
+import json
+import os
+import threading
+import faiss
+import numpy as np
 from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from config import (
     GITHUB_TOKEN,
-    BASE_URL,
+    HTTP_CLIENT,
+    LLM_BASE_URL,
     LLM_MODEL,
     LLM_TEMPERATURE,
-    RETRIEVAL_K
+    RETRIEVAL_FETCH_K,
+    CONTEXT_TOKEN_BUDGET,
+    CHUNK_SIZE,
+    SEMANTIC_CACHE_PATH,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES
 )
 
 
+SYSTEM_PROMPT = """You are a helpful assistant that answers questions based on the provided context.
+Use the following pieces of context to answer the question at the end.
+If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+Context: """
+
+
+def build_messages(context: str, question: str) -> List[dict]:
+    """
+    Build the chat messages for a question and its retrieved context
+    
+    The prompt never changes, so it is filled with plain string
+    concatenation instead of rendering a ChatPromptTemplate per question.
+    
+    Args:
+        context: Formatted retrieved documents
+        question: The question to ask
+        
+    Returns:
+        List of role/content message dictionaries
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT + context},
+        {"role": "user", "content": question}
+    ]
+
+
+class SemanticCache:
+    """
+    Caches answers keyed by question embedding so near-duplicate questions skip the LLM
+    
+    One instance can be shared by several Streamlit sessions, so every access
+    to the index and entries is serialized by a lock. Disk writes happen
+    outside it, from a snapshot, so lookups never wait on a save. Each vector
+    store gets its own directory under path, keyed by index_id, holding at
+    most max_entries answers.
+    """
+    
+    def __init__(self, index_id: str, path: str = SEMANTIC_CACHE_PATH,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.index_id = index_id
+        self.path = os.path.join(path, index_id)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.index = None  # Created on first add, once the embedding dimension is known
+        self.entries = []
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()  # Orders snapshot writes
+        self._version = 0  # Bumped per snapshot
+        self._written_version = 0
+        self._load()
+    
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """Convert a question embedding into a unit-norm (1, dim) float32 array"""
+        q_vec = np.asarray([embedding], dtype="float32")
+        faiss.normalize_L2(q_vec)
+        return q_vec
+    
+    def lookup(self, embedding: List[float]) -> Optional[dict]:
+        """
+        Find a cached result for a question embedding
+        
+        Args:
+            embedding: Embedding of the question
+            
+        Returns:
+            Cached result dictionary or None if no entry is similar enough
+        """
+        q_vec = self._normalize(embedding)
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return None
+            
+            D, I = self.index.search(q_vec, 1)
+            if D[0, 0] >= self.threshold:
+                return dict(self.entries[I[0, 0]])
+            return None
+    
+    def add(self, embedding: List[float], result: dict):
+        """
+        Store a result for a question embedding and persist the cache
+        
+        Args:
+            embedding: Embedding of the question
+            result: Dictionary with 'answer' and 'sources' keys
+        """
+        q_vec = self._normalize(embedding)
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(q_vec.shape[1])
+            self.index.add(q_vec)
+            self.entries.append(result)
+            
+            # Evict the oldest answers; a flat index keeps the rest in order
+            overflow = len(self.entries) - self.max_entries
+            if overflow > 0:
+                self.index.remove_ids(np.arange(overflow, dtype="int64"))
+                del self.entries[:overflow]
+            snapshot = self._snapshot()
+        self._write(*snapshot)
+    
+    def save(self):
+        """Save cached vectors and results to disk"""
+        with self._lock:
+            if self.index is None:
+                return
+            snapshot = self._snapshot()
+        self._write(*snapshot)
+    
+    def _snapshot(self) -> tuple:
+        """Copy the index and entries so they can be written without the lock"""
+        self._version += 1
+        return self._version, faiss.serialize_index(self.index), list(self.entries)
+    
+    def _write(self, version: int, index_bytes: np.ndarray, entries: list):
+        """
+        Write a snapshot to disk unless a newer one has already been written
+        
+        Each file is written to a temporary path and renamed into place, so
+        a reader never sees a partially written file.
+        """
+        with self._write_lock:
+            if version <= self._written_version:
+                return
+            
+            os.makedirs(self.path, exist_ok=True)
+            index_file = os.path.join(self.path, "cache.faiss")
+            entries_file = os.path.join(self.path, "cache.json")
+            index_bytes.tofile(index_file + ".tmp")
+            with open(entries_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"index_id": self.index_id, "entries": entries}, f)
+            os.replace(index_file + ".tmp", index_file)
+            os.replace(entries_file + ".tmp", entries_file)
+            self._written_version = version
+    
+    def _load(self):
+        """Load the cache from disk if it was built for the same vector store"""
+        index_file = os.path.join(self.path, "cache.faiss")
+        entries_file = os.path.join(self.path, "cache.json")
+        if not (os.path.exists(index_file) and os.path.exists(entries_file)):
+            return
+        
+        with open(entries_file, encoding="utf-8") as f:
+            data = json.load(f)
+        
+        # Answers cached for a different set of documents are stale
+        if data.get("index_id") != self.index_id:
+            return
+        
+        index = faiss.read_index(index_file)
+        # The two files are replaced one after the other; skip a torn pair
+        if index.ntotal != len(data["entries"]):
+            return
+        self.index = index
+        self.entries = data["entries"]
+
+
 class QAChain:
     """Handles question-answering using RAG with source attribution"""
     
     def __init__(self, vectorstore):
         self.vectorstore = vectorstore
+        self.embeddings = vectorstore.embedding_function
         self.llm = self._initialize_llm()
         self.retriever = vectorstore.as_retriever(
-            search_kwargs={"k": RETRIEVAL_K}
+            search_kwargs={"k": RETRIEVAL_FETCH_K}
         )
         
-        # Create prompt template
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a helpful assistant that answers questions based on the provided context.
-Use the following pieces of context to answer the question at the end.
-If you don't know the answer, just say that you don't know, don't try to make up an answer.
-
-Context: {context}"""),
-            ("human", "{question}")
-        ])
-        
-        self.chain = self._create_chain()
+        self.semantic_cache = SemanticCache(self.vectorstore_id(vectorstore))
+    
+    @staticmethod
+    def vectorstore_id(vectorstore) -> str:
+        """Fingerprint the vector store contents so cached answers are tied to it"""
+        doc_ids = sorted(vectorstore.index_to_docstore_id.values())
+        return hashlib.sha1("\n".join(doc_ids).encode("utf-8")).hexdigest()
     
     def _initialize_llm(self):
         """Initialize the language model"""
         llm = ChatOpenAI(
             model=LLM_MODEL,
             api_key=GITHUB_TOKEN,
-            base_url=BASE_URL,
-            temperature=LLM_TEMPERATURE
+            base_url=LLM_BASE_URL,
+            temperature=LLM_TEMPERATURE,
+            http_client=HTTP_CLIENT
         )
         return llm
     
     def _format_docs(self, docs):
-        """Format retrieved documents into a single string"""
-        return "\n\n".join(doc.page_content for doc in docs)
-    
-    def _create_chain(self):
-        """Create the RAG chain"""
-        chain = (
-            {
-                "context": self.retriever | self._format_docs,
-                "question": RunnablePassthrough()
-            }
-            | self.prompt
-            | self.llm
+        """
+        Format retrieved documents into a single string
+        
+        Chunks are emitted in ingestion order with stable id markers so the
+        same chunks always produce the same prompt prefix, which lets
+        providers with prefix caching reuse the KV cache across questions.
+        """
+        ordered = sorted(docs, key=lambda doc: doc.metadata.get("chunk_index", 0))
+        return "\n\n".join(
+            f'<chunk id="{doc.metadata.get("chunk_id", "")}">\n{doc.page_content}\n</chunk>'
+            for doc in ordered
         )
-        return chain
+    
+    def _build_messages(self, docs, question: str):
+        """Fill the prompt with the retrieved documents and the question"""
+        return build_messages(self._format_docs(docs), question)
+    
+    def _fit_context(self, docs) -> list:
+        """
+        Keep the most relevant documents that fit CONTEXT_TOKEN_BUDGET
+        
+        Uses the 'token_len' recorded at ingestion, so nothing is
+        re-tokenized per question. Candidates that would overflow the
+        budget are skipped in favour of shorter, less relevant ones. The
+        top document is always kept. Chunks from indexes saved without
+        counts are treated as full size.
+        """
+        fitted = []
+        total = 0
+        for doc in docs:
+            token_len = doc.metadata.get("token_len", CHUNK_SIZE)
+            if fitted and total + token_len > CONTEXT_TOKEN_BUDGET:
+                continue
+            fitted.append(doc)
+            total += token_len
+        return fitted
+    
+    def _retrieve(self, embedding: List[float]) -> list:
+        """Retrieve documents for an already embedded question"""
+        docs = self.vectorstore.similarity_search_by_vector(embedding, k=RETRIEVAL_FETCH_K)
+        return self._fit_context(docs)
     
     def ask(self, question: str) -> str:
         """
@@ -71,40 +266,99 @@ Context: {context}"""),
         Returns:
             Answer string
         """
-        response = self.chain.invoke(question)
+        docs = self._fit_context(self.retriever.invoke(question))
+        response = self.llm.invoke(self._build_messages(docs, question))
         return response.content
     
+    def ask_stream(self, question: str) -> Iterator[str]:
+        """
+        Ask a question and stream the answer as it is generated
+        
+        Args:
+            question: The question to ask
+            
+        Yields:
+            Answer text chunks
+        """
+        docs = self._fit_context(self.retriever.invoke(question))
+        yield from self._stream_answer(docs, question)
+    
+    def _stream_answer(self, docs, question: str) -> Iterator[str]:
+        """Stream an answer for a question using already retrieved documents"""
+        for chunk in self.llm.stream(self._build_messages(docs, question)):
+            yield chunk.content
+    
+    def _extract_sources(self, docs) -> List[str]:
+        """Extract unique sources from documents, preserving retrieval order"""
+        return list(dict.fromkeys(
+            doc.metadata["source"] for doc in docs if doc.metadata.get("source")
+        ))
+    
     def ask_with_sources(self, question: str) -> dict:
         """
         Ask a question and get answer with source attribution
         
+        The question is embedded once; the embedding serves both the
+        semantic cache lookup and retrieval, and the retrieved documents
+        feed both the prompt and the sources.
+        
         Args:
             question: The question to ask
             
         Returns:
-            Dictionary with 'answer' and 'sources' keys
+            Dictionary with 'answer' and 'sources' (list of source URLs) keys
         """
-        # Use invoke() instead of get_relevant_documents()
-        docs = self.retriever.invoke(question)
+        # Near-duplicate questions reuse the earlier answer
+        embedding = self.embeddings.embed_query(question)
+        cached = self.semantic_cache.lookup(embedding)
+        if cached is not None:
+            return cached
         
-        # Get answer
-        answer = self.ask(question)
+        docs = self._retrieve(embedding)
+        response = self.llm.invoke(self._build_messages(docs, question))
         
-        # Extract unique sources
-        sources = []
-        seen_sources = set()
-        for doc in docs:
-            if hasattr(doc, 'metadata') and 'source' in doc.metadata:
-                source = doc.metadata['source']
-                if source not in seen_sources:
-                    sources.append(source)
-                    seen_sources.add(source)
+        result = {
+            "answer": response.content,
+            "sources": self._extract_sources(docs)
+        }
+        self.semantic_cache.add(embedding, result)
+        return result
+    
+    def stream_with_sources(self, question: str) -> dict:
+        """
+        Ask a question and stream the answer, with source attribution
+        
+        Sources are resolved before generation starts. The answer is cached
+        once the stream has been fully consumed.
         
+        Args:
+            question: The question to ask
+            
+        Returns:
+            Dictionary with 'answer' (iterator of text chunks) and 'sources'
+            (list of source URLs) keys
+        """
+        embedding = self.embeddings.embed_query(question)
+        cached = self.semantic_cache.lookup(embedding)
+        if cached is not None:
+            return {"answer": iter([cached["answer"]]), "sources": cached["sources"]}
+        
+        docs = self._retrieve(embedding)
+        sources = self._extract_sources(docs)
         return {
-            "answer": answer,
-            "sources": "\n".join(sources) if sources else "No sources available"
+            "answer": self._stream_and_cache(docs, question, embedding, sources),
+            "sources": sources
         }
     
+    def _stream_and_cache(self, docs, question: str, embedding: List[float],
+                          sources: List[str]) -> Iterator[str]:
+        """Stream an answer and add it to the semantic cache when complete"""
+        parts = []
+        for text in self._stream_answer(docs, question):
+            parts.append(text)
+            yield text
+        self.semantic_cache.add(embedding, {"answer": "".join(parts), "sources": sources})
+    
     def get_relevant_documents(self, question: str) -> list:
         """
         Get relevant documents for a question without generating answer
@@ -113,7 +367,8 @@ Context: {context}"""),
             question: The question to search for
             
         Returns:
-            List of relevant documents
+            List of relevant documents, fitted to the context budget like
+            the documents the other ask methods put in the prompt
         """
         # Use invoke() instead of get_relevant_documents()
-        return self.retriever.invoke(question)
\ No newline at end of file
+        return self._fit_context(self.retriever.invoke(question))
\ No newline at end of file